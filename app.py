@@ -1,9 +1,14 @@
 import streamlit as st
-import google.genai as genai
-from google.genai import types
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import os
-import json
-import re
+import orjson
+from typing import Literal
+from pydantic import BaseModel
+import hashlib
+import functools
+import threading
+import html
+from concurrent.futures import ThreadPoolExecutor
 
 
 # =========================================================
@@ -20,253 +25,338 @@ st.set_page_config(
 # =========================================================
 # ⚠️ For safety, in real use put this in an env var or st.secrets
 GEMINI_API_KEY = st.secrets.get("GEMINI_API_KEY", "")
-os.environ["GEMINI_API_KEY"] = GEMINI_API_KEY
+HAS_API_KEY = bool(GEMINI_API_KEY) and GEMINI_API_KEY != "YOUR_GEMINI_API_KEY_HERE"
+if not HAS_API_KEY:
+    st.error("Please set your Gemini API Key (env var GEMINI_API_KEY or inside the script).")
 
-try:
-    if GEMINI_API_KEY and GEMINI_API_KEY != "YOUR_GEMINI_API_KEY_HERE":
-        client = genai.Client()
-    else:
-        st.error("Please set your Gemini API Key (env var GEMINI_API_KEY or inside the script).")
-        client = None
-except Exception as e:
-    st.error(f"Error initializing Gemini client: {e}")
-    client = None
 
-# =========================================================
-# Helper: robust JSON parsing
-# =========================================================
-def parse_gemini_json(raw: str):
+@st.cache_resource
+def get_gemini_client():
     """
-    Try to recover valid JSON from Gemini's output.
-    Handles code fences and simple trailing commas.
-    Returns dict or None.
+    Build the Gemini client once per server process and reuse it across reruns.
+    The SDK is imported here, on the first analysis, so the first page render
+    does not pay for it. Returns the client, or None if init fails.
     """
-    if not raw:
-        return None
-
-    raw = raw.strip()
-    # Remove ```json fences if model adds them
-    raw = raw.replace("```json", "").replace("```", "").strip()
+    from google import genai
 
-    # Try to isolate the main JSON object
+    os.environ["GEMINI_API_KEY"] = GEMINI_API_KEY
     try:
-        start = raw.index("{")
-        end = raw.rindex("}") + 1
-        json_str = raw[start:end]
-    except ValueError:
+        return genai.Client()
+    except Exception as e:
+        st.error(f"Error initializing Gemini client: {e}")
         return None
 
-    # Remove trailing commas before } or ]
-    json_str = re.sub(r",\s*([}\]])", r"\1", json_str)
+# =========================================================
+# Response schema – Gemini returns JSON that already matches these models
+# =========================================================
+class Medicine(BaseModel):
+    name: str
+    dosage: str
+    frequency: str
+    purpose: str
+    side_effects: list[str]
+
+
+class Interaction(BaseModel):
+    drug1: str
+    drug2: str
+    risk_level: Literal["High", "Moderate", "Low"]
+    effect: str
+    mechanism: str
+    recommendation: str
+
+
+class PrescriptionAnalysis(BaseModel):
+    id: str
+    medicines: list[Medicine]
+    interactions: list[Interaction]
+    note: str
+
+
+class BatchAnalysis(BaseModel):
+    results: list[PrescriptionAnalysis]
 
-    try:
-        return json.loads(json_str)
-    except Exception:
-        return None
 
 # =========================================================
 # Custom CSS
 # =========================================================
-st.markdown("""
-<style>
-.stApp {
-    background: linear-gradient(135deg, #eef2ff 0%, #f9fafb 100%);
-}
+@st.cache_data
+def load_css() -> str:
+    """Read app.css once per process; reruns reuse the cached <style> block."""
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.css"), encoding="utf-8") as f:
+        return f"<style>\n{f.read()}</style>"
 
-/* Generic card */
-.app-card {
-    background: #ffffff;
-    padding: 20px 22px;
-    border-radius: 18px;
-    box-shadow: 0 12px 28px rgba(15,23,42,0.08);
-    border: 1px solid #e5e7eb;
-    margin-bottom: 18px;
-}
 
-.section-title {
-    font-size: 22px;
-    font-weight: 650;
-    margin-bottom: 6px;
-}
-.sub-label {
-    font-size: 12px;
-    color: #6b7280;
-}
+st.markdown(load_css(), unsafe_allow_html=True)
 
-/* Pill for medicine name */
-.med-pill {
-    display:inline-block;
-    padding:4px 10px;
-    border-radius:999px;
-    background:#e0e7ff;
-    color:#111827;
-    font-size:12px;
-    font-weight:600;
-    margin:2px 6px 2px 0;
-}
+# =========================================================
+# Response cache – identical inputs skip the Gemini round-trip
+# =========================================================
+GEMINI_MODEL = "gemini-2.5-flash"
+# Bump whenever prompt_instruction or the response schema changes so stale answers are not reused
+PROMPT_VERSION = 3
+RESPONSE_CACHE_MAX_ENTRIES = 128
+# Larger uploads are split into batches of this size and sent concurrently
+MAX_ITEMS_PER_REQUEST = 4
 
-/* Interaction risk cards */
-.risk-card {
-    border-radius: 14px;
-    padding: 14px 16px;
-    margin-bottom: 12px;
-    border-left: 5px solid;
-    background: #ffffff;
-    box-shadow: 0 4px 10px rgba(15,23,42,0.06);
-}
 
-.risk-high {
-    border-color: #b91c1c;
-    background: #fef2f2;
-}
-.risk-moderate {
-    border-color: #92400e;
-    background: #fffbeb;
-}
-.risk-low {
-    border-color: #166534;
-    background: #ecfdf5;
-}
+@st.cache_resource
+def _response_cache():
+    """
+    (Process-wide {payload_hash: (results_list, raw_text)} store, lock). Shared by all sessions
+    and the batch worker threads, so every read, insert and eviction holds the lock.
+    """
+    return {}, threading.Lock()
+
+
+def _payload_hash(items) -> str:
+    """Hash of (model, prompt version, and each item's mime type + bytes or text) used as the cache key."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{GEMINI_MODEL}|{PROMPT_VERSION}|{len(items)}|".encode())
+    for item in items:
+        if isinstance(item, str):
+            payload = item.strip().encode()
+            h.update(f"text/plain|{len(payload)}|".encode())
+            h.update(payload)
+        else:
+            # Hash the upload's buffer in place – bytes are only copied on a cache miss
+            with item.getbuffer() as buf:
+                h.update(f"{item.type}|{buf.nbytes}|".encode())
+                h.update(buf)
+    return h.hexdigest()
 
-/* Risk label */
-.risk-label {
-    display:inline-block;
-    padding:2px 8px;
-    border-radius:999px;
-    font-size:11px;
-    font-weight:700;
-    margin-bottom:4px;
-}
-.risk-label-high {
-    background:#fee2e2;
-    color:#b91c1c;
-}
-.risk-label-moderate {
-    background:#fef3c7;
-    color:#92400e;
-}
-.risk-label-low {
-    background:#dcfce7;
-    color:#166534;
-}
 
-.side-pill {
-    display:inline-block;
-    padding:3px 8px;
-    margin:2px 4px 2px 0;
-    border-radius:999px;
-    background:#e5e7eb;
-    font-size:11px;
-}
-</style>
-""", unsafe_allow_html=True)
+def _split_batch_results(data_obj, n: int):
+    """
+    Map the model's {"results": [{"id": ..., ...}]} answer back onto the n inputs (same order).
+    Returns a list of n structured dicts, or None if the answer has no usable shape or leaves
+    any input out (an empty result would read as "no medicines found" and be cached).
+    """
+    if not isinstance(data_obj, dict):
+        return None
+    results = data_obj.get("results")
+    if not isinstance(results, list):
+        # A single prescription sometimes comes back unwrapped
+        return [data_obj] if n == 1 and "medicines" in data_obj else None
+
+    by_id = {str(r.get("id")): r for r in results if isinstance(r, dict)}
+    split = []
+    for i in range(n):
+        r = by_id.get(str(i + 1))
+        if r is None and len(results) == n and isinstance(results[i], dict):
+            r = results[i]
+        if r is None:
+            return None
+        split.append(r)
+    return split
 
 # =========================================================
-# Gemini logic – returns (structured_dict_or_None, raw_text)
+# Gemini logic – returns (list_of_structured_dicts_or_None, raw_text)
 # =========================================================
-def process_prescription_with_gemini(data, is_file: bool):
+def process_prescription_with_gemini(items, placeholder=None):
     """
-    Call Gemini and return (structured_data_dict or None, raw_text_response).
-    structured_data has keys:
+    Analyze one or more prescriptions.
+    `items` is a list of uploaded files (image/PDF) and/or prescription text strings.
+    Returns (results or None, raw_text_response), where results holds one structured
+    dict per item, in the same order:
         medicines: [ {name, dosage, frequency, purpose, side_effects[]} ]
         interactions: [ {drug1, drug2, risk_level, effect, mechanism, recommendation} ]
         note: str
+    Up to MAX_ITEMS_PER_REQUEST items share one Gemini call; larger uploads are split
+    and the batches run concurrently. A single batch is streamed into `placeholder`.
     """
+    client = get_gemini_client() if HAS_API_KEY else None
     if not client:
         return None, "**Error:** Gemini client not initialized. Check your API key."
 
+    batches = [items[i:i + MAX_ITEMS_PER_REQUEST] for i in range(0, len(items), MAX_ITEMS_PER_REQUEST)]
+    if len(batches) == 1:
+        return _analyze_batch(client, batches[0], placeholder)
+
+    # Workers share this run's context (for the st caches) but must not touch
+    # Streamlit elements, so no streaming here
+    ctx = get_script_run_ctx()
+    with ThreadPoolExecutor(
+        max_workers=len(batches),
+        initializer=lambda: add_script_run_ctx(threading.current_thread(), ctx),
+    ) as pool:
+        outputs = list(pool.map(functools.partial(_analyze_batch, client), batches))
+
+    raw = "\n\n".join(raw_text for _, raw_text in outputs)
+    if any(results is None for results, _ in outputs):
+        return None, raw
+    return [r for results, _ in outputs for r in results], raw
+
+
+def _analyze_batch(client, items, placeholder=None):
+    """One Gemini call for a batch of prescriptions; same return shape as process_prescription_with_gemini."""
+    cache, cache_lock = _response_cache()
+    key = _payload_hash(items)
+    with cache_lock:
+        hit = cache.get(key)
+    if hit is not None:
+        return hit
+
     prompt_instruction = """
 You are a highly specialized medical prescription analysis system.
 
-Your task is to read a prescription (text or scanned image/PDF) and return ONLY a valid JSON object,
-with no additional commentary, Markdown, or explanation. The JSON MUST match the structure below exactly:
-
-{
-  "medicines": [
-    {
-      "name": "string",
-      "dosage": "string",
-      "frequency": "string",
-      "purpose": "string",
-      "side_effects": ["string", "string"]
-    }
-  ],
-  "interactions": [
-    {
-      "drug1": "string",
-      "drug2": "string",
-      "risk_level": "High",
-      "effect": "string",
-      "mechanism": "string",
-      "recommendation": "string"
-    }
-  ],
-  "note": "This is not a substitute for professional medical advice."
-}
-
------------------ EXTRACTION GUIDELINES -----------------
-
-1. Extract every medicine distinctly, even if dosage/frequency is unclear.
-2. For EACH medicine, identify:
-   - Name (brand or generic)
-   - Dosage & Strength (e.g., "625mg", "1 tablet")
-   - Frequency/directions (e.g., "1-0-1 × 5 days", "after meals")
-   - Purpose (infection, pain relief, acidity control, etc.)
-   - 3–6 likely side effects based on medical knowledge.
-
-3. Drug Interaction Analysis:
-   - Compare every possible combination of medicines.
-   - Only include interactions that have clinical significance.
-   - The field "risk_level" MUST be exactly one of: "High", "Moderate", or "Low".
-   - For each interaction include:
-       - EFFECT on patient
-       - MECHANISM (how the interaction occurs)
-       - RECOMMENDATION (avoid / spacing / monitoring / safe alternative).
-
------------------ CRITICAL FORMAT RULES -----------------
-
-✔ Output must be ONLY JSON — no Markdown, code fences, or backticks.
-✔ Keys and string values MUST be double-quoted.
-✔ No trailing commas.
-✔ Response must be directly parseable via json.loads().
-
-If data is missing or unreadable, use an empty string "" or [] but NEVER change keys or structure.
+You will receive one or more prescriptions (text or scanned image/PDF), each introduced by a
+"Prescription <id>:" line. Analyze EACH one independently and return one result per prescription,
+using the same id.
+
+1. Extract every medicine distinctly, even if dosage/frequency is unclear: name (brand or generic),
+   dosage & strength (e.g. "625mg"), frequency/directions (e.g. "1-0-1 × 5 days"), purpose,
+   and 3–6 likely side effects.
+2. Compare every combination of medicines within the same prescription and list only clinically
+   significant interactions, with effect, mechanism and recommendation
+   (avoid / spacing / monitoring / safe alternative).
+3. If data is missing or unreadable, use "" or [].
 """
 
-    # Build contents (image first, then instruction – matches docs style)
-    if is_file:
-        file_bytes = data.getvalue()
-        mime_type = data.type
-        file_part = types.Part.from_bytes(data=file_bytes, mime_type=mime_type)
-        contents = [file_part, prompt_instruction]
-    else:
-        text = data.strip()
-        contents = [prompt_instruction, f"Prescription text:\n{text}"]
+    from google.genai import types
+
+    # Build contents: instruction first, then each prescription tagged with its id
+    contents = [prompt_instruction]
+    for i, item in enumerate(items, start=1):
+        if isinstance(item, str):
+            contents.append(f"Prescription {i}:\n{item.strip()}")
+        else:
+            contents.append(f"Prescription {i}:")
+            contents.append(types.Part.from_bytes(data=item.getvalue(), mime_type=item.type))
 
     try:
-        # IMPORTANT: call without config to avoid version issues that cause 'NoneType' errors
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
+        stream = client.models.generate_content_stream(
+            model=GEMINI_MODEL,
             contents=contents,
+            config=types.GenerateContentConfig(
+                response_mime_type="application/json",
+                response_schema=BatchAnalysis,
+            ),
         )
 
-        raw = getattr(response, "text", "") or ""
-        if not raw and response.candidates:
-            parts = response.candidates[0].content.parts
-            raw = "".join(p.text or "" for p in parts)
-
-        data_obj = parse_gemini_json(raw)
-        return data_obj, raw or "**Error:** Empty response from model."
+        raw = ""
+        for chunk in stream:
+            # chunk.text joins the chunk's parts on every access, so read it once
+            text = chunk.text
+            if not text:
+                continue
+            raw += text
+            if placeholder is not None:
+                placeholder.code(raw, language="json")
+        if placeholder is not None:
+            placeholder.empty()
+
+        # Schema-constrained output only fails to load if the stream was cut short
+        try:
+            data_obj = orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            data_obj = None
+        results = _split_batch_results(data_obj, len(items))
+        if results is not None:
+            _attach_render_fields(results)
+        result = (results, raw or "**Error:** Empty response from model.")
+        # Only cache answers we could parse; failures should be retried
+        if results is not None:
+            with cache_lock:
+                if key not in cache and len(cache) >= RESPONSE_CACHE_MAX_ENTRIES:
+                    cache.pop(next(iter(cache)))
+                cache[key] = result
+        return result
 
     except Exception as e:
         # If Gemini itself errors, surface that as raw text
         return None, f"An error occurred during API call: {e}"
 
+# =========================================================
+# Rendering helpers – model output is escaped before it goes into HTML
+# =========================================================
+# risk level -> (card CSS classes, label CSS classes)
+RISK_CLASSES = {
+    "high": ("risk-card risk-high", "risk-label risk-label-high"),
+    "moderate": ("risk-card risk-moderate", "risk-label risk-label-moderate"),
+    "low": ("risk-card risk-low", "risk-label risk-label-low"),
+}
+
+
+def _side_effect_pills(side_effects) -> str:
+    """Escaped side-effect pills for one medicine."""
+    return " ".join(f"<span class='side-pill'>{html.escape(str(se))}</span>" for se in side_effects or ())
+
+
+def _attach_render_fields(results):
+    """Pre-render per-medicine fragments once per analysis; they are stored alongside the results."""
+    for r in results:
+        for m in r.get("medicines") or []:
+            m["_pills_html"] = _side_effect_pills(m.get("side_effects"))
+
+
+def _medicine_key(m):
+    """Hashable (name, dosage, frequency, purpose, side_effect_pills_html) tuple for one medicine dict."""
+    pills_html = m.get("_pills_html")
+    if pills_html is None:
+        pills_html = _side_effect_pills(m.get("side_effects"))
+    return (
+        str(m.get("name") or "Unknown"),
+        str(m.get("dosage") or ""),
+        str(m.get("frequency") or ""),
+        str(m.get("purpose") or ""),
+        pills_html,
+    )
+
+
+@st.cache_data(max_entries=512, show_spinner=False)
+def _render_medicine(key):
+    """Return (pill_html, details_html) for one medicine, given its _medicine_key()."""
+    name, dosage, frequency, purpose, pills_html = key
+    name = html.escape(name)
+    pill = f"<span class='med-pill'>{name}</span>"
+
+    rows = []
+    for label, value in (("Dosage", dosage), ("Frequency", frequency), ("Purpose", purpose)):
+        if value:
+            rows.append(f"<li><b>{label}:</b> {html.escape(value)}</li>")
+    if pills_html:
+        rows.append(f"<li><b>Common side effects:</b> {pills_html}</li>")
+
+    details = (
+        f"<div style='margin:12px 0;'><b>• {name}</b>"
+        f"<ul style='margin:4px 0 0 0;'>{''.join(rows)}</ul></div>"
+    )
+    return pill, details
+
+
+def _interaction_key(inter):
+    """Hashable (drug1, drug2, effect, mechanism, recommendation) tuple for one interaction dict."""
+    return (
+        str(inter.get("drug1") or "Unknown"),
+        str(inter.get("drug2") or "Unknown"),
+        str(inter.get("effect") or "—"),
+        str(inter.get("mechanism") or "—"),
+        str(inter.get("recommendation") or "—"),
+    )
+
+
+@st.cache_data(max_entries=512, show_spinner=False)
+def _render_interaction_card(key, card_cls: str, label_cls: str, level_label: str) -> str:
+    """Return the HTML card for one drug interaction, given its _interaction_key()."""
+    d1, d2, effect, mech, rec = (html.escape(v) for v in key)
+    return (
+        f'<div class="{card_cls}">'
+        f'<div class="{label_cls}">{level_label} RISK</div>'
+        f'<div><b>{d1}</b> + <b>{d2}</b></div>'
+        f'<div style="font-size:13px;margin-top:6px;">'
+        f'<b>Effect:</b> {effect}<br/>'
+        f'<b>Mechanism:</b> {mech}<br/>'
+        f'<b>Recommendation:</b> {rec}'
+        f'</div>'
+        f'</div>'
+    )
+
 # =========================================================
 # Session state
 # =========================================================
 if "analysis_data" not in st.session_state:
-    st.session_state.analysis_data = None   # parsed JSON dict
+    st.session_state.analysis_data = None   # list of parsed JSON dicts, one per prescription
 if "analysis_raw" not in st.session_state:
     st.session_state.analysis_raw = None    # fallback text
 
@@ -278,7 +368,7 @@ st.markdown(
     <div style="margin-bottom:18px;">
         <h1 style="margin-bottom:4px;">🩺 AI Prescription Reader</h1>
         <p style="color:#4b5563; font-size:15px;">
-            Upload a prescription (image/PDF) or paste the text. The app will extract medicines and check for
+            Upload one or more prescriptions (image/PDF) or paste the text. The app will extract medicines and check for
             <b>potential adverse drug interactions</b> using Gemini, with highlighted risk levels.
         </p>
     </div>
@@ -292,138 +382,114 @@ st.markdown(
 left_col, right_col = st.columns([1.0, 1.6])
 
 # ---------------- LEFT: INPUT ----------------
-with left_col:
-    # File card
-    st.markdown("<div class='app-card'>", unsafe_allow_html=True)
-    st.markdown("<div class='section-title'>📂 Upload Prescription (Image / PDF)</div>", unsafe_allow_html=True)
-    st.markdown("<p class='sub-label'>Supported formats: JPG, JPEG, PNG, PDF</p>", unsafe_allow_html=True)
+def _clear_analysis():
+    """Clear-button callback; runs before the rerun so the text area can still be reset."""
+    st.session_state.prescription_text_input = ""
+    st.session_state.analysis_data = None
+    st.session_state.analysis_raw = None
 
-    uploaded_file = st.file_uploader(
-        label=" ",
-        type=["jpg", "jpeg", "png", "pdf"],
-        label_visibility="collapsed",
-    )
-    analyze_file = st.button("✨ Analyze File", use_container_width=True, disabled=uploaded_file is None)
 
-    if uploaded_file is not None:
-        st.success(f"Selected: **{uploaded_file.name}**")
+with left_col:
+    # Inputs live in a form so picking files / typing does not rerun the script;
+    # only the submit buttons below do.
+    with st.form("analyze_form", border=False):
+        # File card
+        st.markdown("<div class='app-card'>", unsafe_allow_html=True)
+        st.markdown("<div class='section-title'>📂 Upload Prescriptions (Image / PDF)</div>", unsafe_allow_html=True)
+        st.markdown("<p class='sub-label'>Supported formats: JPG, JPEG, PNG, PDF – several files are analyzed together</p>", unsafe_allow_html=True)
+
+        uploaded_files = st.file_uploader(
+            label=" ",
+            type=["jpg", "jpeg", "png", "pdf"],
+            accept_multiple_files=True,
+            label_visibility="collapsed",
+        )
+        analyze_file = st.form_submit_button("✨ Analyze Files", use_container_width=True)
 
-    st.markdown("</div>", unsafe_allow_html=True)
+        st.markdown("</div>", unsafe_allow_html=True)
 
-    # Text card
-    st.markdown("<div class='app-card'>", unsafe_allow_html=True)
-    st.markdown("<div class='section-title'>📝 Paste Prescription Text</div>", unsafe_allow_html=True)
-
-    prescription_text = st.text_area(
-        label="Prescription text",
-        placeholder="Example:\nWarfarin 5 mg – 1 tablet once daily\nIbuprofen 400 mg – PRN for pain\n...",
-        height=220,
-        label_visibility="collapsed",
-        key="prescription_text_input",
-    )
+        # Text card
+        st.markdown("<div class='app-card'>", unsafe_allow_html=True)
+        st.markdown("<div class='section-title'>📝 Paste Prescription Text</div>", unsafe_allow_html=True)
 
-    c1, c2 = st.columns(2)
-    with c1:
-        analyze_text = st.button("🧠 Analyze Text", use_container_width=True)
-    with c2:
-        clear_text = st.button("🗑️ Clear", use_container_width=True)
+        prescription_text = st.text_area(
+            label="Prescription text",
+            placeholder="Example:\nWarfarin 5 mg – 1 tablet once daily\nIbuprofen 400 mg – PRN for pain\n...",
+            height=220,
+            label_visibility="collapsed",
+            key="prescription_text_input",
+        )
 
-    if clear_text:
-        st.session_state.prescription_text_input = ""
-        st.session_state.analysis_data = None
-        st.session_state.analysis_raw = None
-        st.rerun()
+        c1, c2 = st.columns(2)
+        with c1:
+            analyze_text = st.form_submit_button("🧠 Analyze Text", use_container_width=True)
+        with c2:
+            st.form_submit_button("🗑️ Clear", use_container_width=True, on_click=_clear_analysis)
 
-    st.markdown("</div>", unsafe_allow_html=True)
+        st.markdown("</div>", unsafe_allow_html=True)
 
 # ---------------- RIGHT: RESULTS ----------------
 with right_col:
     st.markdown("<div class='app-card'>", unsafe_allow_html=True)
     st.markdown("<div class='section-title'>💊 Detected Medicines & Interactions</div>", unsafe_allow_html=True)
 
+    # Filled with the partial model output while an analysis is streaming
+    stream_placeholder = st.empty()
+
     data = st.session_state.analysis_data
     raw = st.session_state.analysis_raw
 
     if data:
-        # ----- Medicines -----
-        st.markdown("#### 1. Extracted Medicines")
-        meds = data.get("medicines", [])
-        if meds:
-            for m in meds:
+        for result in data:
+            if len(data) > 1:
+                st.markdown(f"### 📄 {result.get('source', 'Prescription')}")
+
+            # ----- Medicines -----
+            st.markdown("#### 1. Extracted Medicines")
+            meds = result.get("medicines", [])
+            if meds:
+                # pills + details built in one pass, sent as a single element
+                pills, details = zip(*(_render_medicine(_medicine_key(m)) for m in meds))
                 st.markdown(
-                    f"<span class='med-pill'>{m.get('name','Unknown')}</span>",
-                    unsafe_allow_html=True
+                    f"<div style='margin-bottom:8px;'>{''.join(pills)}</div>{''.join(details)}",
+                    unsafe_allow_html=True,
                 )
-            st.write("")  # spacing
-            for m in meds:
-                st.markdown(f"**• {m.get('name','Unknown')}**")
-                if m.get("dosage"):
-                    st.markdown(f"- **Dosage:** {m['dosage']}")
-                if m.get("frequency"):
-                    st.markdown(f"- **Frequency:** {m['frequency']}")
-                if m.get("purpose"):
-                    st.markdown(f"- **Purpose:** {m['purpose']}")
-                side_effects = m.get("side_effects") or []
-                if side_effects:
-                    se_html = " ".join(
-                        f"<span class='side-pill'>{se}</span>" for se in side_effects
+            else:
+                st.write("_No medicines could be confidently extracted._")
+
+            # ----- Interactions -----
+            st.markdown("----")
+            st.markdown("#### 2. Drug Interactions (Highlighted by Risk)")
+
+            interactions = result.get("interactions", [])
+            if not interactions:
+                st.write("_No significant interactions detected based on standard references._")
+            else:
+                # group by risk in a single pass
+                buckets = {}
+                for inter in interactions:
+                    buckets.setdefault((inter.get("risk_level") or "").lower(), []).append(inter)
+
+                risk_order = ["High", "Moderate", "Low"]
+                for level in risk_order:
+                    group = buckets.get(level.lower(), [])
+                    if not group:
+                        continue
+
+                    # risk heading
+                    st.markdown(f"**{level} Risk ({len(group)})**")
+
+                    card_cls, label_cls = RISK_CLASSES[level.lower()]
+                    level_label = level.upper()
+                    # all cards of one risk level go out as a single element
+                    cards_html = "".join(
+                        _render_interaction_card(_interaction_key(inter), card_cls, label_cls, level_label)
+                        for inter in group
                     )
-                    st.markdown(f"- **Common side effects:** {se_html}", unsafe_allow_html=True)
-                st.write("")
-        else:
-            st.write("_No medicines could be confidently extracted._")
-
-        # ----- Interactions -----
-        st.markdown("----")
-        st.markdown("#### 2. Drug Interactions (Highlighted by Risk)")
-
-        interactions = data.get("interactions", [])
-        if not interactions:
-            st.write("_No significant interactions detected based on standard references._")
-        else:
-            # group by risk
-            risk_order = ["High", "Moderate", "Low"]
-            for level in risk_order:
-                group = [i for i in interactions if i.get("risk_level","").lower() == level.lower()]
-                if not group:
-                    continue
-
-                # risk heading
-                st.markdown(f"**{level} Risk ({len(group)})**")
-
-                for inter in group:
-                    d1 = inter.get("drug1", "Unknown")
-                    d2 = inter.get("drug2", "Unknown")
-                    effect = inter.get("effect", "")
-                    mech = inter.get("mechanism", "")
-                    rec = inter.get("recommendation", "")
-
-                    # pick CSS classes
-                    if level.lower() == "high":
-                        card_cls = "risk-card risk-high"
-                        label_cls = "risk-label risk-label-high"
-                    elif level.lower() == "moderate":
-                        card_cls = "risk-card risk-moderate"
-                        label_cls = "risk-label risk-label-moderate"
-                    else:
-                        card_cls = "risk-card risk-low"
-                        label_cls = "risk-label risk-label-low"
-
-                    html = f"""
-                    <div class="{card_cls}">
-                        <div class="{label_cls}">{level.upper()} RISK</div>
-                        <div><b>{d1}</b> + <b>{d2}</b></div>
-                        <div style="font-size:13px;margin-top:6px;">
-                            <b>Effect:</b> {effect or '—'}<br/>
-                            <b>Mechanism:</b> {mech or '—'}<br/>
-                            <b>Recommendation:</b> {rec or '—'}
-                        </div>
-                    </div>
-                    """
-                    st.markdown(html, unsafe_allow_html=True)
+                    st.markdown(cards_html, unsafe_allow_html=True)
 
         # ----- note / disclaimer -----
-        note = data.get("note") or (
+        note = data[0].get("note") or (
             "This analysis is generated by an AI system and is not a substitute for professional medical advice."
         )
         st.markdown("---")
@@ -449,18 +515,25 @@ with right_col:
 # =========================================================
 # Triggers
 # =========================================================
-if analyze_file and uploaded_file is not None:
-    with st.spinner("Analyzing file and checking for interactions..."):
-        data_obj, raw_text = process_prescription_with_gemini(uploaded_file, is_file=True)
-        st.session_state.analysis_data = data_obj
-        st.session_state.analysis_raw = raw_text
-        st.rerun()
+if analyze_file:
+    if uploaded_files:
+        with st.spinner("Analyzing files and checking for interactions..."):
+            results, raw_text = process_prescription_with_gemini(uploaded_files, placeholder=stream_placeholder)
+            if results is not None:
+                results = [dict(r, source=f.name) for r, f in zip(results, uploaded_files)]
+            st.session_state.analysis_data = results
+            st.session_state.analysis_raw = raw_text
+            st.rerun()
+    else:
+        st.warning("Please upload at least one prescription file before analyzing.")
 
 if analyze_text:
     if prescription_text.strip():
         with st.spinner("Analyzing text and checking for interactions..."):
-            data_obj, raw_text = process_prescription_with_gemini(prescription_text, is_file=False)
-            st.session_state.analysis_data = data_obj
+            results, raw_text = process_prescription_with_gemini([prescription_text], placeholder=stream_placeholder)
+            if results is not None:
+                results = [dict(r, source="Pasted text") for r in results]
+            st.session_state.analysis_data = results
             st.session_state.analysis_raw = raw_text
             st.rerun()
     else:
@@ -5,7 +5,16 @@ from google.genai import types
 import os
 import json
 import re
+import html
+import orjson
+import time
+import threading
+import heapq
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor
+from collections import Counter
+from hashlib import blake2b
 from urllib.parse import quote_plus
+from cachetools import TTLCache
 
 # ---------------------------
 # Page config
@@ -20,35 +29,47 @@ st.set_page_config(
 # Gemini / API key
 # ---------------------------
 GEMINI_API_KEY = st.secrets.get("GEMINI_API_KEY", "")
-os.environ["GEMINI_API_KEY"] = GEMINI_API_KEY
-try:
-    if GEMINI_API_KEY and GEMINI_API_KEY != "YOUR_GEMINI_API_KEY_HERE":
-        client = genai.Client()
-    else:
-        st.error("Please set your Gemini API Key (env var GEMINI_API_KEY or inside st.secrets).")
-        client = None
-except Exception as e:
-    st.error(f"Error initializing Gemini client: {e}")
-    client = None
+HAS_API_KEY = bool(GEMINI_API_KEY) and GEMINI_API_KEY != "YOUR_GEMINI_API_KEY_HERE"
+if not HAS_API_KEY:
+    st.error("Please set your Gemini API Key (env var GEMINI_API_KEY or inside st.secrets).")
+
+@st.cache_resource
+def get_gemini_client():
+    """One client (and HTTP connection pool) per server process, reused across reruns and sessions."""
+    os.environ["GEMINI_API_KEY"] = GEMINI_API_KEY
+    try:
+        return genai.Client()
+    except Exception as e:
+        st.error(f"Error initializing Gemini client: {e}")
+        return None
+
+client = get_gemini_client() if HAS_API_KEY else None
 
 # ---------------------------
 # Helpers
 # ---------------------------
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+
 def parse_gemini_json(raw: str):
     """Robust JSON extractor."""
     if not raw:
         return None
-    raw = raw.strip().replace("```json", "").replace("```", "").strip()
+    # fast path: schema-constrained output is normally clean JSON already
+    try:
+        return orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        pass
+    # code fences and chatter sit outside the outermost braces, so the slice drops them
     try:
         start = raw.index("{")
         end = raw.rindex("}") + 1
         json_str = raw[start:end]
     except ValueError:
         return None
-    json_str = re.sub(r",\s*([}\]])", r"\1", json_str)
+    json_str = _TRAILING_COMMA_RE.sub(r"\1", json_str)
     try:
-        return json.loads(json_str)
-    except Exception:
+        return orjson.loads(json_str)
+    except orjson.JSONDecodeError:
         try:
             fixed = json_str.replace("'", '"')
             return json.loads(fixed)
@@ -75,36 +96,62 @@ DISEASE_LINKS = {
     "gastritis": ["https://www.niddk.nih.gov/health-information/digestive-diseases/gastritis"],
 }
 
+# Other names the model uses for a DISEASE_LINKS key; only used when they are the whole name
+LINK_ALIASES = {
+    "flu": "influenza",
+    "covid-19": "covid",
+    "coronavirus": "covid",
+    "cold": "common cold",
+    "strep": "strep throat",
+    "uti": "urinary tract infection",
+    "stomach flu": "gastroenteritis",
+    "polycystic ovary syndrome": "pcos",
+    "underactive thyroid": "hypothyroidism",
+}
+
+@st.cache_resource
+def _link_index():
+    """
+    (name -> DISEASE_LINKS key, pattern) built once per process. The pattern finds the first
+    DISEASE_LINKS key inside longer model names, e.g. "Influenza (flu)". Aliases are left out of
+    it: short ones like "cold" would match "Cold sore" and link the wrong condition.
+    """
+    names = dict(LINK_ALIASES)
+    names.update({key: key for key in DISEASE_LINKS})
+    pattern = re.compile(r"\b(" + "|".join(re.escape(k) for k in sorted(DISEASE_LINKS, key=len, reverse=True)) + r")\b")
+    return names, pattern
+
+# Search pages used when a disease has no curated link
+FALLBACK_SEARCH_URLS = ("https://www.cdc.gov/search?q={q}", "https://www.who.int/search?q={q}")
+
+@st.cache_data(max_entries=512, show_spinner=False)
+def _fallback_links(disease_name: str):
+    """Search links for a lowercased disease name; shared by every casing the model uses."""
+    q = quote_plus(disease_name)
+    return [url.format(q=q) for url in FALLBACK_SEARCH_URLS]
+
+@st.cache_data(max_entries=256, show_spinner=False)
 def get_learn_more_links(disease_name: str):
     if not disease_name:
         return []
-    dn = disease_name.lower()
-    for key in DISEASE_LINKS:
-        if key in dn or dn in key:
-            return DISEASE_LINKS[key]
-    q = quote_plus(disease_name)
-    return [f"https://www.cdc.gov/search?q={q}", f"https://www.who.int/search?q={q}"]
+    names, pattern = _link_index()
+    dn = disease_name.strip().lower()
+    key = names.get(dn)
+    if key is None:
+        m = pattern.search(dn)
+        key = m.group(1) if m else None
+    if key is not None:
+        return DISEASE_LINKS[key]
+    return _fallback_links(dn)
 
 # ---------------------------
 # UI styling (kept simple)
 # ---------------------------
-st.markdown(
-    """
-<style>
-.stApp { background: linear-gradient(135deg,#f6f8ff 0%, #fbfdff 100%); }
-.card { background:#fff; padding:16px; border-radius:12px; box-shadow:0 8px 20px rgba(15,23,42,0.04); border:1px solid #eef2ff; margin-bottom:16px; }
-.h1 { font-size:26px; font-weight:800; }
-.h2 { font-size:16px; font-weight:700; }
-.pred-pill { display:inline-block; padding:6px 12px; border-radius:999px; background:#e6f0ff; font-weight:700; margin-right:8px; }
-.small-pill { display:inline-block; padding:4px 8px; border-radius:999px; background:#f1f5f9; font-size:12px; }
-.prog-outer { width:240px; height:12px; border-radius:8px; background:#eef2ff; overflow:hidden; display:inline-block; margin-right:8px; }
-.prog-inner { height:12px; border-radius:8px; }
-.next-steps { background:#fbfcff; border-left:4px solid #60a5fa; padding:10px; border-radius:8px; margin-top:8px; }
-.learn-more { display:inline-block; padding:6px 10px; border-radius:8px; background:#0ea5e9; color:white; text-decoration:none; margin-right:8px; font-size:13px; }
-</style>
-""",
-    unsafe_allow_html=True,
-)
+@st.cache_data
+def load_css() -> str:
+    """Read symptom_predictor.css once per process; reruns reuse the cached <style> block."""
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "symptom_predictor.css"), encoding="utf-8") as f:
+        return f"<style>\n{f.read()}</style>"
 
 # ---------------------------
 # Symptom list (kept large)
@@ -119,116 +166,364 @@ COMMON_SYMPTOMS = [
     "Excessive thirst", "Excessive urination", "Night sweats", "Confusion", "Seizures",
     "Loss of consciousness", "Severe bleeding", "Severe abdominal pain"
 ]
+COMMON_SYMPTOMS_SET = frozenset(COMMON_SYMPTOMS)
+
+def build_symptoms_text(checklist, free_text: str) -> str:
+    """The symptom description sent to Gemini and used by the heuristic fallback."""
+    text = ""
+    if checklist:
+        text += "Checklist: " + ", ".join(checklist) + ". "
+    if free_text:
+        text += "Free text: " + free_text
+    return text
 
 # ---------------------------
-# Prompt (few-shot + emphasis on common conditions)
+# Response cache (identical symptom sets skip the API call)
 # ---------------------------
-def call_gemini_for_symptoms(symptoms_text: str, top_k: int = 3):
-    if not client:
-        return None, "**Error:** Gemini client not initialized. Check your API key."
+@st.cache_resource
+def _gemini_cache():
+    """
+    (TTL cache of (parsed, raw) answers, lock); held by st.cache_resource since script globals
+    reset every rerun. TTLCache isn't thread-safe and every session runs in its own thread.
+    """
+    return TTLCache(maxsize=512, ttl=600), threading.Lock()
 
-    # Few-shot examples + explicit bias toward common conditions when ambiguous
-    prompt = f"""
-You are a clinical triage assistant for educational purposes only.
+def _symptoms_cache_key(checklist, free_text: str, top_k: int) -> bytes:
+    """
+    Key on the sorted checklist items, the free text verbatim (whitespace-normalized only) and
+    top_k. Numbers, word order and negation in the free text all change the key.
+    """
+    payload = orjson.dumps({
+        "s": sorted(item.strip().lower() for item in checklist),
+        "f": " ".join(free_text.split()),
+        "k": top_k,
+    })
+    return blake2b(payload, digest_size=16).digest()
 
-TASK: Read the user's symptoms and return ONLY a strict JSON object with top {top_k} most likely conditions,
-ranked by probability (most likely first). Use exactly this schema:
-
-{{
-  "predictions": [
-    {{
-      "disease": "string",
-      "probability": 0.0,
-      "description": "short (1-2 sentence) plain-language description",
-      "consult": "which specialist or clinic (max 4 words)",
-      "precautions": ["short bullet strings (3-6 items)"],
-      "links": ["optional authoritative URLs, if known"]
-    }}
-  ],
-  "note": "This is NOT a diagnosis. Seek medical care when appropriate."
-}}
-
-IMPORTANT GUIDANCE (READ CAREFULLY):
-- When symptoms are non-specific or could be many things, **prefer common/benign causes first** (e.g., common cold, influenza, gastroenteritis, UTI, tension headache, migraine, reflux, gastritis, PCOS for relevant menstrual features, hypothyroidism for fatigue/weight gain). 
-- Include chronic/non-acute conditions (PCOS, hypothyroidism, anemia) when relevant symptoms appear (e.g., irregular periods, weight gain, hair growth → PCOS).
-- Keep descriptions short (<= 35 words). Do NOT recommend specific medications or doses.
-- Probabilities should reflect relative likelihood (0-1). They don't need to sum to 1 exactly but should be plausible.
-- If uncertain, still return common diagnoses rather than rare high-mortality diseases.
-
-EXAMPLE 1
-Symptoms:
-"Runny nose, sneezing, low-grade fever for 2 days, mild sore throat"
+# ---------------------------
+# Prompt (few-shot + emphasis on common conditions)
+# ---------------------------
+# Invariant instructions + one worked example, sent as the system instruction so every call
+# shares the same prefix; the user content carries only the symptom sets.
+PROMPT_PREAMBLE = """
+You are a clinical triage assistant for educational purposes only.
 
-OUTPUT:
-{{
-  "predictions": [
-    {{
-      "disease":"Common cold",
-      "probability":0.55,
-      "description":"Viral upper respiratory infection causing runny nose, sneezing, sore throat; usually self-limited.",
-      "consult":"Primary care",
-      "precautions":["Rest","Hydration","Paracetamol if fever","Avoid close contact"],
-      "links":[]
-    }},
-    {{
-      "disease":"Influenza (flu)",
-      "probability":0.25,
-      "description":"Viral respiratory infection with fever and body aches; can be more severe than cold.",
-      "consult":"Primary care",
-      "precautions":["Rest","Hydration","Seek care if severe"],
-      "links":[]
-    }}
-  ],
-  "note":"This is NOT a diagnosis. Seek care if concerned."
-}}
-
-EXAMPLE 2
-Symptoms:
-"Irregular periods, weight gain, increased facial hair, acne"
+TASK: You will receive one or more numbered symptom sets, each from a different person. Analyze EACH set
+independently and return ONLY a strict JSON object with one entry in "results" per set, using the set's
+number as "id". For every set, list the requested number of most likely conditions, ranked by probability
+(most likely first). Follow the schema of the example output exactly:
+- "description": plain language, <= 20 words
+- "consult": which specialist or clinic (max 4 words)
+- "precautions": exactly 3 items, <= 8 words each; no medications or doses
+- "probability": relative likelihood 0-1
+
+GUIDANCE:
+- Prefer common/benign causes when symptoms are non-specific; include chronic conditions (PCOS, hypothyroidism, anemia) when their symptoms appear. Avoid rare high-mortality diagnoses unless clearly indicated.
+- Never let one set's symptoms influence another set's predictions.
+
+EXAMPLE
+Symptom sets:
+Set 1 (return top 2):
+\"\"\"
+Runny nose, sneezing, low-grade fever for 2 days, mild sore throat
+\"\"\"
 
-OUTPUT:
-{{
-  "predictions":[
-    {{
-      "disease":"Polycystic ovary syndrome (PCOS)",
-      "probability":0.7,
-      "description":"Hormonal disorder with irregular cycles, acne, hirsutism, and weight gain common in PCOS.",
-      "consult":"Endocrinology / Gyn",
-      "precautions":["Record menstrual history","Check glucose and lipids","See specialist for evaluation"],
-      "links":[]
-    }},
-    {{
-      "disease":"Hypothyroidism",
-      "probability":0.15,
-      "description":"Low thyroid hormone can cause weight gain and irregular menses; confirm with blood tests.",
-      "consult":"Endocrinology",
-      "precautions":["Check TSH/T4","Discuss symptoms with clinician"],
-      "links":[]
-    }}
-  ],
-  "note":"This is NOT a diagnosis. Seek care if concerned."
-}}
-
-Now analyze these symptoms and return JSON only.
-
-Symptoms:
+Set 2 (return top 1):
 \"\"\"
-{symptoms_text}
+Irregular periods, weight gain, increased facial hair, acne
 \"\"\"
+
+OUTPUT:
+{"results":[
+ {"id":1,"predictions":[
+  {"disease":"Common cold","probability":0.55,"description":"Viral upper respiratory infection; usually clears up on its own.","consult":"Primary care","precautions":["Rest","Hydration","Avoid close contact"]},
+  {"disease":"Influenza (flu)","probability":0.25,"description":"Viral infection with fever and body aches; often more severe than a cold.","consult":"Primary care","precautions":["Rest","Hydration","Seek care if breathing worsens"]}],
+  "note":"This is NOT a diagnosis. Seek care if concerned."},
+ {"id":2,"predictions":[
+  {"disease":"Polycystic ovary syndrome (PCOS)","probability":0.7,"description":"Hormonal disorder causing irregular cycles, acne, excess hair and weight gain.","consult":"Endocrinology / Gyn","precautions":["Record menstrual history","Check glucose and lipids","See specialist for evaluation"]}],
+  "note":"This is NOT a diagnosis. Seek care if concerned."}
+]}
 """
-    try:
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=[prompt],
+
+# Output cap: generation time grows with output length, so budget per requested prediction
+# (a full-length prediction is ~90-100 tokens of JSON; leave headroom so valid answers aren't cut)
+OUTPUT_TOKENS_PER_PREDICTION = 130
+OUTPUT_TOKENS_PER_SET = 40
+
+# Structured-output schema: Gemini returns JSON that already matches it, so no text scraping
+PREDICTION_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "disease": {"type": "STRING"},
+        "probability": {"type": "NUMBER"},
+        "description": {"type": "STRING"},
+        "consult": {"type": "STRING"},
+        "precautions": {"type": "ARRAY", "items": {"type": "STRING"}},
+    },
+    "required": ["disease", "probability", "description", "consult", "precautions"],
+}
+RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "results": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "id": {"type": "INTEGER"},
+                    "predictions": {"type": "ARRAY", "items": PREDICTION_SCHEMA},
+                    "note": {"type": "STRING"},
+                },
+                "required": ["id", "predictions"],
+            },
+        },
+    },
+    "required": ["results"],
+}
+
+# Per-call part of the prompt; everything invariant lives in PROMPT_PREAMBLE
+PROMPT_TEMPLATE = "Analyze these symptom sets and return JSON only.\n\nSymptom sets:\n{symptom_sets}\n"
+SYMPTOM_SET_TEMPLATE = 'Set {id} (return top {top_k}):\n"""\n{symptoms_text}\n"""'
+
+def build_batch_prompt(requests):
+    """Per-call part of the prompt for a list of (symptoms_text, top_k); set ids are 1-based positions."""
+    symptom_sets = "\n\n".join(
+        SYMPTOM_SET_TEMPLATE.format(id=i, top_k=top_k, symptoms_text=text)
+        for i, (text, top_k) in enumerate(requests, start=1)
+    )
+    return PROMPT_TEMPLATE.format(symptom_sets=symptom_sets)
+
+# ---------------------------
+# Request batching: concurrent users share one Gemini call
+# ---------------------------
+# Smallest tier is enough for short structured triage; escalate when it keeps failing to parse
+GEMINI_MODEL = st.secrets.get("GEMINI_MODEL", "gemini-2.5-flash-lite")
+GEMINI_FALLBACK_MODEL = "gemini-2.5-flash"
+MAX_PARSE_FAILURES = 2
+
+BATCH_WINDOW_S = 0.15      # how long to wait for more requests before sending
+MAX_BATCH_SIZE = 8
+MAX_CONCURRENT_BATCHES = 8  # Gemini streams in flight at once, per process
+BATCH_TIMEOUT_S = 120
+PROGRESS_POLL_S = 0.3       # rerun interval while a request is in flight...
+FAST_POLLS = 5
+PROGRESS_POLL_SLOW_S = 1.0  # ...backing off to this after the first FAST_POLLS reruns
+
+class PendingRequest:
+    """
+    One queued symptom query; `chars_received` grows while its batch is streaming. When the
+    request is alone in its batch, `chunks` is the live list of streamed text so the caller can
+    show the partial answer (a shared batch would expose other sessions' answers).
+    Only `shareable` requests (fixed checklist options, no user-typed text) are ever put in a
+    prompt together with other sessions' requests.
+    """
+
+    def __init__(self, symptoms_text: str, top_k: int, shareable: bool = False):
+        self.symptoms_text = symptoms_text
+        self.top_k = top_k
+        self.shareable = shareable
+        self.future = Future()
+        self.chars_received = 0
+        self.chunks = None
+        self.cache_key = None
+        self.submitted_at = time.monotonic()
+        self.polls = 0
+
+    def resolve(self, result):
+        """Set the (parsed, raw) answer unless the page already gave up on (cancelled) the request."""
+        try:
+            self.future.set_result(result)
+        except InvalidStateError:
+            pass
+
+    def abandoned(self) -> bool:
+        """Cancelled by the page, or past BATCH_TIMEOUT_S (the page stops waiting then)."""
+        if time.monotonic() - self.submitted_at > BATCH_TIMEOUT_S:
+            self.future.cancel()
+        return self.future.cancelled()
+
+class SymptomBatcher:
+    """
+    Coalesces requests from all sessions: a background worker sends every non-shareable request
+    alone as soon as it arrives, waits BATCH_WINDOW_S after the first pending shareable request
+    and groups those into prompts of up to MAX_BATCH_SIZE, and hands each batch to a pool of
+    MAX_CONCURRENT_BATCHES threads, so one slow stream doesn't hold up the rest. Each request's
+    Future gets its own (parsed, raw) slice of the answer.
+    """
+
+    def __init__(self, gemini_client):
+        self._client = gemini_client
+        self._cond = threading.Condition()
+        self._pending = []
+        self._pool = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_BATCHES, thread_name_prefix="gemini-symptom-batch")
+        self._failures_lock = threading.Lock()
+        self._parse_failures = 0           # consecutive unparseable answers from GEMINI_MODEL
+        threading.Thread(target=self._run, name="gemini-symptom-batcher", daemon=True).start()
+
+    def submit(self, symptoms_text: str, top_k: int, shareable: bool = False) -> PendingRequest:
+        req = PendingRequest(symptoms_text, top_k, shareable)
+        with self._cond:
+            self._pending.append(req)
+            self._cond.notify()
+        return req
+
+    def _run(self):
+        # only collects and dispatches; the Gemini calls run on the pool
+        window_ends = None  # set while shareable requests wait for company
+        while True:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    shared = [req for req in self._pending if req.shareable]
+                    solo = [req for req in self._pending if not req.shareable]
+                    if shared and window_ends is None:
+                        window_ends = now + BATCH_WINDOW_S
+                    # requests that never share a prompt don't wait for the window
+                    if solo or (shared and now >= window_ends):
+                        break
+                    self._cond.wait(None if window_ends is None else window_ends - now)
+                if shared and now >= window_ends:
+                    self._pending, window_ends = [], None
+                else:
+                    self._pending, shared = shared, []
+            # requests nobody is waiting for any more don't cost an API call
+            shared = [req for req in shared if not req.abandoned()]
+            batches = [shared[i:i + MAX_BATCH_SIZE] for i in range(0, len(shared), MAX_BATCH_SIZE)]
+            batches += [[req] for req in solo if not req.abandoned()]
+            for batch in batches:
+                self._pool.submit(self._answer_or_fail, batch)
+
+    def _answer_or_fail(self, batch):
+        try:
+            self._answer(batch)
+        except Exception as e:
+            for req in batch:
+                req.resolve((None, f"An error occurred during API call: {e}"))
+
+    @staticmethod
+    def _config(max_output_tokens: int):
+        """
+        The invariant preamble goes as the system instruction: it is a stable prefix, so Gemini's
+        implicit caching applies, and it is too short for an explicit cached content.
+        """
+        return types.GenerateContentConfig(
+            system_instruction=PROMPT_PREAMBLE,
+            response_mime_type="application/json",
+            response_schema=RESPONSE_SCHEMA,
+            max_output_tokens=max_output_tokens,
+            temperature=0.2,
+            # short classification: hidden thinking tokens would dominate latency
+            thinking_config=types.ThinkingConfig(thinking_budget=0),
         )
-        raw = getattr(response, "text", "") or ""
-        if not raw and response.candidates:
-            parts = response.candidates[0].content.parts
-            raw = "".join(p.text or "" for p in parts)
+
+    def _stream(self, batch, model, prompt):
+        """(raw text, finish reason of the stream's last candidate)."""
+        chunks = []
+        received = 0
+        finish_reason = None
+        if len(batch) == 1:
+            batch[0].chunks = chunks
+        for chunk in self._client.models.generate_content_stream(
+            model=model,
+            contents=[prompt],
+            config=self._config(
+                sum(OUTPUT_TOKENS_PER_SET + OUTPUT_TOKENS_PER_PREDICTION * req.top_k for req in batch)
+            ),
+        ):
+            if chunk.candidates and chunk.candidates[0].finish_reason:
+                finish_reason = chunk.candidates[0].finish_reason
+            text = chunk.text
+            if not text:
+                continue
+            chunks.append(text)
+            received += len(text)
+            for req in batch:
+                req.chars_received = received
+            if all(req.abandoned() for req in batch):
+                break
+        return "".join(chunks), finish_reason
+
+    def _answer(self, batch):
+        prompt = build_batch_prompt([(req.symptoms_text, req.top_k) for req in batch])
+        with self._failures_lock:
+            model = GEMINI_FALLBACK_MODEL if self._parse_failures >= MAX_PARSE_FAILURES else GEMINI_MODEL
+        raw, finish_reason = self._stream(batch, model, prompt)
+        if all(req.abandoned() for req in batch):
+            return
+        truncated = finish_reason == types.FinishReason.MAX_TOKENS
+
         parsed = parse_gemini_json(raw)
-        return parsed, raw or "**Error:** Empty response from model."
+        results = parsed.get("results") if isinstance(parsed, dict) else None
+        by_id = {}
+        if isinstance(results, list):
+            results = [r for r in results if isinstance(r, dict)]
+            # only ids this batch actually sent, each answered exactly once, are trusted
+            id_counts = Counter(r.get("id") for r in results)
+            by_id = {
+                r["id"]: r for r in results
+                if type(r.get("id")) is int and 1 <= r["id"] <= len(batch) and id_counts[r["id"]] == 1
+            }
+        # a success (on either model) drops back to GEMINI_MODEL for the next batch; an answer
+        # cut off at max_output_tokens says nothing about the model's output, so it isn't counted
+        with self._failures_lock:
+            if by_id:
+                self._parse_failures = 0
+            elif not truncated:
+                self._parse_failures += 1
+
+        for i, req in enumerate(batch, start=1):
+            item = by_id.get(i)
+            if item and item.get("predictions"):
+                data_obj = {"predictions": item["predictions"], "note": item.get("note", "")}
+                req.resolve((data_obj, json.dumps(data_obj, indent=2)))
+            elif truncated:
+                req.resolve((None, "**Error:** The model's answer hit the length limit before it finished. Please try again."))
+            elif len(batch) == 1:
+                req.resolve((None, raw or "**Error:** Empty response from model."))
+            else:
+                # don't show other people's answers in this user's raw-output fallback
+                req.resolve((None, "**Error:** Could not parse the model output for these symptoms."))
+
+@st.cache_resource
+def get_symptom_batcher():
+    """One batcher (and worker thread) per server process, shared by every session."""
+    return SymptomBatcher(client)
+
+def start_symptom_request(checklist, free_text: str, top_k: int = 3):
+    """
+    (result, pending) for one symptom query: either the cached or immediate (parsed, raw)
+    result, or the PendingRequest queued on the batcher, with the other one None. The script
+    doesn't wait on it: the page polls it across reruns.
+    (PendingRequest is redefined on every rerun, so callers can't isinstance-check it.)
+    """
+    if not client:
+        return (None, "**Error:** Gemini client not initialized. Check your API key."), None
+
+    cache, cache_lock = _gemini_cache()
+    key = _symptoms_cache_key(checklist, free_text, top_k)
+    with cache_lock:
+        hit = cache.get(key)
+    if hit is not None:
+        return hit, None
+
+    # only requests built purely from fixed checklist options may share a prompt
+    shareable = not free_text and all(item in COMMON_SYMPTOMS_SET for item in checklist)
+    req = get_symptom_batcher().submit(build_symptoms_text(checklist, free_text), top_k, shareable)
+    req.cache_key = key
+    return None, req
+
+def finish_symptom_request(req: PendingRequest):
+    """(parsed, raw) for a request whose future is done; parseable answers go in the cache."""
+    try:
+        result = req.future.result(timeout=0)
     except Exception as e:
         return None, f"An error occurred during API call: {e}"
+    # only cache answers we could parse; failures should be retried
+    if result[0] is not None:
+        cache, cache_lock = _gemini_cache()
+        with cache_lock:
+            cache[req.cache_key] = result
+    return result
 
 # ---------------------------
 # Heuristics: inject common conditions when model is low-confidence
@@ -246,6 +541,27 @@ COMMON_HEURISTIC_MAP = {
     "gastritis": ["heartburn", "stomach pain", "upper abdominal pain", "indigestion", "bloating"],
 }
 
+@st.cache_resource
+def _keyword_index():
+    """
+    (pattern, keyword -> disease indices, disease names, keyword words) built once per
+    process from COMMON_HEURISTIC_MAP. The pattern matches every keyword in one sweep, longest first.
+    Matches don't overlap, so a keyword also counts for diseases whose shorter keywords it
+    contains ("high fever" is evidence for influenza and, via "fever", covid-19).
+    """
+    names = tuple(COMMON_HEURISTIC_MAP)
+    keywords = sorted({kw for kws in COMMON_HEURISTIC_MAP.values() for kw in kws}, key=len, reverse=True)
+    pattern = re.compile(r"\b(" + "|".join(re.escape(kw) for kw in keywords) + r")\b")
+    kw_to_idx = {
+        kw: tuple(
+            i for i, kws in enumerate(COMMON_HEURISTIC_MAP.values())
+            if any(re.search(r"\b" + re.escape(k) + r"\b", kw) for k in kws)
+        )
+        for kw in keywords
+    }
+    kw_tokens = frozenset(re.findall(r"[a-z]+", " ".join(keywords)))
+    return pattern, kw_to_idx, names, kw_tokens
+
 def heuristic_inject(common_text: str, preds: list, min_top_thresh: float = 0.30):
     """
     If top model confidence is low (< min_top_thresh), add heuristic common candidates
@@ -269,19 +585,19 @@ def heuristic_inject(common_text: str, preds: list, min_top_thresh: float = 0.30
     if top_prob >= min_top_thresh:
         return sorted(preds, key=get_prob, reverse=True)
 
-    # otherwise build heuristic candidates
+    # otherwise build heuristic candidates: one sweep counts keyword hits per disease
     text = common_text.lower()
+    kw_re, kw_to_idx, names, kw_tokens = _keyword_index()
     added = {}
-    for disease, keywords in COMMON_HEURISTIC_MAP.items():
-        for kw in keywords:
-            if kw in text:
-                # small scoring heuristic by keyword match count
-                count = text.count(kw)
-                # assign base probability weight (favor common conditions slightly)
-                base = 0.25 + min(0.35, 0.05 * count)
-                # if already in model preds, we won't duplicate; we will increase its prob later
-                added[disease] = max(added.get(disease, 0.0), base)
-                break
+    # no keyword can match unless one of its words appears, so skip the sweep when none do
+    if kw_tokens.intersection(re.findall(r"[a-z]+", text)):
+        counts = [0] * len(names)
+        for m in kw_re.finditer(text):
+            for i in kw_to_idx[m.group(1)]:
+                counts[i] += 1
+        # small scoring heuristic by keyword match count (favor common conditions slightly);
+        # if already in model preds, we won't duplicate; we will increase its prob later
+        added = {names[i]: 0.25 + min(0.35, 0.05 * c) for i, c in enumerate(counts) if c}
 
     # If nothing matched heuristically, we still add "common cold" or "gastroenteritis" if symptoms mention respiratory/GI words
     if not added:
@@ -303,34 +619,78 @@ def heuristic_inject(common_text: str, preds: list, min_top_thresh: float = 0.30
         # if model already had it, increase to max(existing, heuristic)
         merged[lname] = max(merged.get(lname, 0.0), prob)
 
-    # Build final list with normalized probabilities
-    items = []
-    for name, pv in merged.items():
-        items.append({"disease": name.title(), "probability": float(pv), "description": "", "consult": "", "precautions": [], "links": []})
+    # Normalize probs so they sum to 1 (if total>0), then keep top-K (3);
+    # only the survivors are turned into prediction dicts
+    total = sum(merged.values())
+    if total > 0:
+        scored = [(name, round(pv / total, 3)) for name, pv in merged.items()]
+    else:
+        scored = list(merged.items())
+    return [
+        {"disease": name.title(), "probability": pv, "description": "", "consult": "", "precautions": [], "links": []}
+        for name, pv in heapq.nlargest(3, scored, key=lambda x: x[1])
+    ]
+
+# ---------------------------
+# Rendering helpers
+# ---------------------------
+CUSTOM_PILL_HTML = "<span class='custom-pill'>{}</span>"
 
-    # If still empty (rare), fallback to original preds
-    if not items and preds:
-        items = preds
+# placeholder cards shown while a prediction is in flight
+SKELETON_CARDS_HTML = "<div class='skeleton-card'></div>" * 3
 
-    # Normalize probs so they sum to 1 (if total>0)
-    total = sum(float(i["probability"]) for i in items)
-    if total > 0:
-        for i in items:
-            i["probability"] = round(float(i["probability"]) / total, 3)
-    # sort descending
-    items_sorted = sorted(items, key=lambda x: x["probability"], reverse=True)
-    # keep top-K (3) and ensure description/consult placeholders if missing
-    final = []
-    for it in items_sorted[:3]:
-        final.append({
-            "disease": it.get("disease", "Unknown"),
-            "probability": it.get("probability", 0.0),
-            "description": it.get("description") or "",
-            "consult": it.get("consult") or "",
-            "precautions": it.get("precautions") or [],
-            "links": it.get("links") or []
-        })
-    return final
+@st.cache_data(max_entries=64, show_spinner=False)
+def render_custom_symptoms(symptoms: tuple) -> str:
+    """Pill HTML for the user's custom symptoms; user text is escaped."""
+    return " ".join(CUSTOM_PILL_HTML.format(html.escape(s)) for s in symptoms)
+
+# (minimum confidence %, progress bar color), highest first
+PROGRESS_COLORS = ((70, "#16a34a"), (40, "#f59e0b"), (0, "#ef4444"))
+
+def progress_color(fill_pct: int) -> str:
+    for threshold, color in PROGRESS_COLORS:
+        if fill_pct >= threshold:
+            return color
+    return PROGRESS_COLORS[-1][1]
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def build_cards_html(cards: tuple) -> list:
+    """
+    Static HTML for each prediction card, one string per card. `cards` is a tuple of
+    (disease, fill_pct, color, description, consult, precautions, links) tuples whose text
+    is already HTML-escaped, so reruns that only toggle a checkbox get the cached strings back.
+    """
+    out = []
+    for idx, (disease, fill_pct, prog_color, desc, consult, precautions, links) in enumerate(cards, start=1):
+        html_parts = [
+            "<div style='padding:12px;border-radius:10px;margin-bottom:10px;border:1px solid #f1f5f9;'>",
+            f"<div style='display:flex;justify-content:space-between;align-items:center;margin-bottom:6px;'>"
+            f"<div><span class='pred-pill'>{idx}. {disease}</span></div>"
+            f"<div style='text-align:right;'><span class='small-pill'>Confidence: {fill_pct}%</span></div>"
+            f"</div>",
+            f"<div style='display:flex;align-items:center;margin-bottom:8px;'>"
+            f"<div class='prog-outer'><div class='prog-inner' style='width:{fill_pct}%;background:{prog_color};'></div></div>"
+            f"<div style='font-size:13px;color:#374151;margin-left:6px'>{fill_pct}%</div>"
+            f"</div>",
+        ]
+        if desc:
+            html_parts.append(f"<p><b>Description:</b> {desc}</p>")
+        if consult:
+            html_parts.append(f"<p><b>Who to consult:</b> {consult}</p>")
+        if precautions:
+            html_parts.append("<p style='margin-bottom:2px;'><b>Precautions / Prevention:</b></p>")
+            html_parts.append("<ul>" + "".join(f"<li>{it}</li>" for it in precautions) + "</ul>")
+
+        # learn more
+        if links:
+            html_parts.append("<p style='margin-bottom:4px;'><b>Learn more:</b></p>")
+            html_parts.append("".join(
+                f"<a class='learn-more' href='{l}' target='_blank' rel='noopener noreferrer'>Open</a> "
+                for l in links
+            ))
+        html_parts.append("</div>")
+        out.append("".join(html_parts))
+    return out
 
 # ---------------------------
 # Session init
@@ -343,11 +703,35 @@ if "predictions_data" not in st.session_state:
     st.session_state.predictions_data = None
 if "predictions_raw" not in st.session_state:
     st.session_state.predictions_raw = None
+if "_user_match_keys" not in st.session_state:
+    st.session_state._user_match_keys = set()
+if "_inflight" not in st.session_state:
+    st.session_state._inflight = None
+
+def clear_user_matches():
+    """Drop the "matches my experience" checkbox states; only keys we created are touched."""
+    for k in st.session_state.pop("_user_match_keys", set()):
+        st.session_state.pop(k, None)
+    st.session_state._user_match_keys = set()
+
+def store_predictions(data_obj, raw_text):
+    """Replace the shown predictions with a new (parsed, raw) answer."""
+    # store raw; results from the previous prediction are stale
+    st.session_state.predictions_raw = raw_text
+    st.session_state.pop("predictions_sig", None)
+    # Defensive: if parsed object missing predictions or probabilities, keep raw for debug
+    if data_obj and isinstance(data_obj, dict) and data_obj.get("predictions"):
+        st.session_state.predictions_data = data_obj
+    else:
+        # As fallback, set predictions_data to an object with empty predictions so UI can show raw
+        st.session_state.predictions_data = {"predictions": []}
+    clear_user_matches()
 
 # ---------------------------
-# Header
+# Header (stylesheet + header card go out in one st.markdown call)
 # ---------------------------
-st.markdown("<div class='card'><div class='h1'>🩺 Symptom → Top Conditions</div><div style='color:#475569'>It aims at easing the possible predcitions for you.</div></div>", unsafe_allow_html=True)
+HEADER_HTML = "<div class='card'><div class='h1'>🩺 Symptom → Top Conditions</div><div style='color:#475569'>It aims at easing the possible predcitions for you.</div></div>"
+st.markdown(load_css() + HEADER_HTML, unsafe_allow_html=True)
 
 # ---------------------------
 # Layout: left inputs, right results
@@ -355,27 +739,27 @@ st.markdown("<div class='card'><div class='h1'>🩺 Symptom → Top Conditions</
 left_col, right_col = st.columns([1, 1.4], gap="large")
 
 with left_col:
-    st.markdown("<div class='card'>", unsafe_allow_html=True)
-    st.markdown("<div class='h2'>🗂 Inputs</div>", unsafe_allow_html=True)
+    st.markdown("<div class='card'><div class='h2'>🗂 Inputs</div>", unsafe_allow_html=True)
     # stable multiselect
     widget_key = "selected_symptoms_widget"
     if widget_key not in st.session_state:
         st.session_state[widget_key] = []
-    selected = st.multiselect("Pick symptoms (check all that apply)", options=COMMON_SYMPTOMS, default=st.session_state.get(widget_key, []), key=widget_key)
+    # the widget's value comes from its key in session state, so no default is passed
+    selected = st.multiselect("Pick symptoms (check all that apply)", options=COMMON_SYMPTOMS, key=widget_key)
     st.session_state.selected_symptoms = list(selected)
+    custom_symptoms = st.session_state.custom_symptoms
 
     new_sym = st.text_input("Add custom symptom (e.g., 'irregular periods')", key="new_symptom_input")
     if st.button("➕ Add symptom", use_container_width=True):
         s = new_sym.strip()
         if s:
-            st.session_state.custom_symptoms.append(s)
+            custom_symptoms.append(s)
             st.session_state.new_symptom_input = ""
             st.rerun()
 
-    if st.session_state.custom_symptoms:
+    if custom_symptoms:
         st.markdown("<div style='margin-top:8px;'><strong>Custom:</strong></div>", unsafe_allow_html=True)
-        custom_html = " ".join(f"<span style='display:inline-block;padding:6px 8px;margin:4px;border-radius:10px;background:#eef2ff'>{s}</span>" for s in st.session_state.custom_symptoms)
-        st.markdown(custom_html, unsafe_allow_html=True)
+        st.markdown(render_custom_symptoms(tuple(custom_symptoms)), unsafe_allow_html=True)
 
     st.markdown("---")
     st.markdown("<div class='h2'>📝 Describe Symptoms (optional)</div>", unsafe_allow_html=True)
@@ -393,130 +777,118 @@ with left_col:
         st.session_state.symptom_free_text_input = ""
         st.session_state.predictions_data = None
         st.session_state.predictions_raw = None
-        # clear user match keys
-        for k in list(st.session_state.keys()):
-            if isinstance(k, str) and k.startswith("user_match_"):
-                try:
-                    del st.session_state[k]
-                except Exception:
-                    pass
+        st.session_state.pop("predictions_sig", None)
+        if st.session_state._inflight is not None:
+            st.session_state._inflight.future.cancel()
+            st.session_state._inflight = None
+        clear_user_matches()
         if widget_key in st.session_state:
             del st.session_state[widget_key]
         st.rerun()
 
     st.markdown("</div>", unsafe_allow_html=True)
 
+# one text of the current inputs, used by the heuristic fallback and sent to Gemini
+checklist = selected + custom_symptoms
+free_text = free_text.strip()
+combined_text = build_symptoms_text(checklist, free_text)
+
 with right_col:
-    st.markdown("<div class='card'>", unsafe_allow_html=True)
-    st.markdown("<div class='h2'>🔔 Results</div>", unsafe_allow_html=True)
+    st.markdown("<div class='card'><div class='h2'>🔔 Results</div>", unsafe_allow_html=True)
+
+    # a request in flight is polled on each rerun (see the bottom of the script)
+    inflight = st.session_state.get("_inflight")
+    if inflight is not None:
+        # abandoned() first: the worker cancels requests past the timeout, and a cancelled
+        # future is also done() but has no result
+        if inflight.abandoned():
+            store_predictions(None, "**Error:** Timed out waiting for the model.")
+            inflight = st.session_state._inflight = None
+        elif inflight.future.done():
+            store_predictions(*finish_symptom_request(inflight))
+            inflight = st.session_state._inflight = None
 
     data = st.session_state.predictions_data
     raw = st.session_state.predictions_raw
 
-    if data:
+    if inflight is not None:
+        # until the answer lands, show skeleton cards (plus the partial answer when streaming solo)
+        st.caption(f"Analyzing symptoms… {inflight.chars_received} chars received")
+        st.markdown(SKELETON_CARDS_HTML, unsafe_allow_html=True)
+        if inflight.chunks:
+            st.code("".join(inflight.chunks), language="json")
+
+    elif data:
         preds = data.get("predictions", []) or []
 
-        # Normalize model probabilities defensively and sort; if low confidence, use heuristic_inject
-        def norm_prob(p):
-            try:
-                pv = float(p.get("probability", 0.0))
-                if pv > 1.0:
-                    pv = min(1.0, pv / 100.0)
-                return pv
-            except Exception:
-                return 0.0
-
-        preds_sorted = sorted(preds, key=norm_prob, reverse=True)
-
-        # if top confidence is low (<30%), run heuristic injection
-        top_conf = norm_prob(preds_sorted[0]) if preds_sorted else 0.0
-        combined_text = ""
-        checklist = list(st.session_state.selected_symptoms) + st.session_state.custom_symptoms
-        if checklist:
-            combined_text += "Checklist: " + ", ".join(checklist) + ". "
-        if free_text:
-            combined_text += "Free text: " + free_text
-
-        if top_conf < 0.30:
-            # merge model preds into a normalized structure for heuristic
-            # But heuristic_inject returns already-normalized top-3 list
-            preds_final = heuristic_inject(combined_text.lower(), preds_sorted, min_top_thresh=0.30)
+        # reuse the top-3 computed on an earlier rerun (e.g. a checkbox toggle) when nothing changed;
+        # the heuristic fallback depends on the current inputs, so they are part of the signature
+        sig = (raw, combined_text)
+        if st.session_state.get("predictions_sig") == sig:
+            preds_final = st.session_state.predictions_final
         else:
-            # ensure top 3 normalized but keep descriptions from model
-            preds_final = []
-            total = sum(norm_prob(p) for p in preds_sorted[:3]) or 1.0
-            for p in preds_sorted[:3]:
-                preds_final.append({
+            # Normalize model probabilities defensively and sort; if low confidence, use heuristic_inject
+            def norm_prob(p):
+                try:
+                    pv = float(p.get("probability", 0.0))
+                    if pv > 1.0:
+                        pv = min(1.0, pv / 100.0)
+                    return pv
+                except Exception:
+                    return 0.0
+
+            # (probability, pred) pairs, normalized once and sorted by probability
+            scored = sorted(((norm_prob(p), p) for p in preds), key=lambda sp: sp[0], reverse=True)
+
+            # if top confidence is low (<30%), run heuristic injection
+            top_conf = scored[0][0] if scored else 0.0
+            if top_conf < 0.30:
+                # merge model preds into a normalized structure for heuristic
+                # But heuristic_inject returns already-normalized top-3 list
+                preds_final = heuristic_inject(combined_text.lower(), [p for _, p in scored], min_top_thresh=0.30)
+            else:
+                # ensure top 3 normalized but keep descriptions from model
+                top3 = scored[:3]
+                total = sum(pv for pv, _ in top3) or 1.0
+                preds_final = [{
                     "disease": p.get("disease", "Unknown"),
-                    "probability": round(norm_prob(p)/total, 3),
+                    "probability": round(pv / total, 3),
                     "description": p.get("description",""),
                     "consult": p.get("consult",""),
                     "precautions": p.get("precautions") or [],
                     "links": p.get("links") or []
-                })
+                } for pv, p in top3]
+            # display fields are derived (and model text escaped) once here, not on every render
+            for p in preds_final:
+                disease = p.get("disease") or "Unknown"
+                p["_fill_pct"] = int(float(p["probability"]) * 100)
+                p["_color"] = progress_color(p["_fill_pct"])
+                p["_disease_safe"] = html.escape(disease)
+                p["_desc_safe"] = html.escape(p.get("description") or "")
+                p["_consult_safe"] = html.escape(p.get("consult") or "")
+                p["_precautions_safe"] = tuple(html.escape(str(it)) for it in p.get("precautions") or [])
+                p["_links_safe"] = tuple(
+                    html.escape(l, quote=True) for l in (p.get("links") or get_learn_more_links(disease))[:3]
+                )
+            st.session_state.predictions_final = preds_final
+            st.session_state.predictions_sig = sig
 
         # render preds_final
         if preds_final:
             st.markdown("#### Top predictions")
-            for idx, p in enumerate(preds_final, start=1):
-                disease = p.get("disease", "Unknown")
-                prob = p.get("probability", 0.0)
-                desc = p.get("description", "")
-                consult = p.get("consult", "")
-                precautions = p.get("precautions") or []
-
-                # percent
-                try:
-                    pval = float(prob)
-                    if pval > 1.0:
-                        pval = min(1.0, pval/100.0)
-                except Exception:
-                    pval = 0.0
-                fill_pct = int(pval * 100)
-
-                if fill_pct >= 70:
-                    prog_color = "#16a34a"
-                elif fill_pct >= 40:
-                    prog_color = "#f59e0b"
-                else:
-                    prog_color = "#ef4444"
-
-                st.markdown("<div style='padding:12px;border-radius:10px;margin-bottom:10px;border:1px solid #f1f5f9;'>", unsafe_allow_html=True)
-                st.markdown(
-                    f"<div style='display:flex;justify-content:space-between;align-items:center;margin-bottom:6px;'>"
-                    f"<div><span class='pred-pill'>{idx}. {disease}</span></div>"
-                    f"<div style='text-align:right;'><span class='small-pill'>Confidence: {fill_pct}%</span></div>"
-                    f"</div>", unsafe_allow_html=True)
-
-                st.markdown(
-                    f"<div style='display:flex;align-items:center;margin-bottom:8px;'>"
-                    f"<div class='prog-outer'><div class='prog-inner' style='width:{fill_pct}%;background:{prog_color};'></div></div>"
-                    f"<div style='font-size:13px;color:#374151;margin-left:6px'>{fill_pct}%</div>"
-                    f"</div>", unsafe_allow_html=True)
-
-                if desc:
-                    st.markdown(f"**Description:** {desc}")
-                if consult:
-                    st.markdown(f"**Who to consult:** {consult}")
-
-                # checkbox after consult, cleared on new predict
+            cards_key = tuple(
+                (p["_disease_safe"], p["_fill_pct"], p["_color"], p["_desc_safe"],
+                 p["_consult_safe"], p["_precautions_safe"], p["_links_safe"])
+                for p in preds_final
+            )
+            for idx, card_html in enumerate(build_cards_html(cards_key), start=1):
+                st.markdown(card_html, unsafe_allow_html=True)
+
+                # checkbox is a widget, so it stays separate; cleared on new predict
                 user_key = f"user_match_{idx}"
+                st.session_state._user_match_keys.add(user_key)
                 checked = st.checkbox("This matches my experience", key=user_key)
 
-                if precautions:
-                    st.markdown("**Precautions / Prevention:**")
-                    for it in precautions:
-                        st.markdown(f"- {it}")
-
-                # learn more
-                links = p.get("links") or get_learn_more_links(disease)
-                if links:
-                    st.markdown("**Learn more:**")
-                    link_html = ""
-                    for l in links[:3]:
-                        link_html += f"<a class='learn-more' href='{l}' target='_blank' rel='noopener noreferrer'>Open</a> "
-                    st.markdown(link_html, unsafe_allow_html=True)
-
                 if checked:
                     st.markdown(
                         """
@@ -530,8 +902,6 @@ with right_col:
                         """,
                         unsafe_allow_html=True)
 
-                st.markdown("</div>", unsafe_allow_html=True)
-
             note = data.get("note") or "This is NOT a diagnosis. Seek professional care."
             st.markdown("---")
             st.markdown(f"> **Disclaimer:** {note}")
@@ -551,33 +921,25 @@ with right_col:
 # ---------------------------
 # Trigger analyze (call Gemini)
 # ---------------------------
-if 'analyze' in locals() and analyze:
-    checklist = list(st.session_state.selected_symptoms) + st.session_state.custom_symptoms
-    combined_text = ""
-    if checklist:
-        combined_text += "Checklist: " + ", ".join(checklist) + ". "
-    free = st.session_state.symptom_free_text_input.strip()
-    if free:
-        combined_text += "Free text: " + free
-
-    if not combined_text.strip():
+if analyze:
+    if not combined_text:
         st.warning("Please select or describe at least one symptom.")
     else:
-        with st.spinner("Analyzing symptoms and generating predictions..."):
-            data_obj, raw_text = call_gemini_for_symptoms(combined_text, top_k=6)
-            # store raw
-            st.session_state.predictions_raw = raw_text
-            # Defensive: if parsed object missing predictions or probabilities, keep raw for debug
-            if data_obj and isinstance(data_obj, dict) and data_obj.get("predictions"):
-                st.session_state.predictions_data = data_obj
-            else:
-                # As fallback, set predictions_data to an object with empty predictions so UI can show raw
-                st.session_state.predictions_data = {"predictions": []}
-            # clear user match keys
-            for k in list(st.session_state.keys()):
-                if isinstance(k, str) and k.startswith("user_match_"):
-                    try:
-                        del st.session_state[k]
-                    except Exception:
-                        pass
-            st.rerun()
+        if st.session_state._inflight is not None:
+            # a new prediction replaces one still in flight
+            st.session_state._inflight.future.cancel()
+            st.session_state._inflight = None
+        result, pending = start_symptom_request(checklist, free_text, top_k=6)
+        if pending is not None:
+            # don't block the script on Gemini: the results column polls it on later reruns
+            st.session_state._inflight = pending
+        else:
+            store_predictions(*result)
+        st.rerun()
+
+# keep rerunning while a request is in flight so the results column can pick it up
+inflight = st.session_state.get("_inflight")
+if inflight is not None:
+    inflight.polls += 1
+    time.sleep(PROGRESS_POLL_S if inflight.polls <= FAST_POLLS else PROGRESS_POLL_SLOW_S)
+    st.rerun()